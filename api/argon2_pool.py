@@ -0,0 +1,266 @@
+"""
+Argon2 hashing over a fixed pool of preallocated work areas.
+
+argon2-cffi allocates (and zeroes) the full memory_cost for every hash. This
+module calls ``argon2.low_level.core`` directly with allocator callbacks that
+hand out one reusable buffer per slot, so a login burst reuses at most
+``slots`` buffers instead of allocating one per attempt. Hashes use the
+standard PHC encoding and are interchangeable with ``argon2.PasswordHasher``.
+
+The callbacks are libffi closures, which need writable and executable memory.
+Hosts that deny it (e.g. SELinux deny_execmem) fall back to PasswordHasher.
+"""
+import base64
+import binascii
+import hmac
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from loguru import logger
+from argon2 import PasswordHasher, Type, extract_parameters
+from argon2.exceptions import (
+    HashingError,
+    InvalidHashError,
+    VerificationError,
+    VerifyMismatchError,
+)
+from argon2.low_level import core, error_to_str, ffi, lib
+
+_ARGON2_BLOCK_SIZE = 1024
+
+
+def _new_callback(signature: str, fn):
+    """Create a cffi callback; raises MemoryError where W+X memory is denied"""
+    return ffi.callback(signature, fn)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    try:
+        return base64.b64decode(data + "=" * (-len(data) % 4), validate=True)
+    except (binascii.Error, ValueError):
+        raise InvalidHashError from None
+
+
+class _Slot:
+    """One reusable argon2 work area and the callbacks that hand it out"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.buffer = None  # allocated on first use
+        self.overflow = None  # one-off buffer for stored hashes above memory_cost
+        self.allocations = 0
+        self.allocate_cbk = None  # callbacks are created on first use
+        self.free_cbk = None
+
+    def ensure_callbacks(self) -> None:
+        """Create the allocator callbacks if this slot has none yet"""
+        if self.allocate_cbk is None:
+            self.free_cbk = _new_callback("void(uint8_t *, size_t)", self._free)
+            self.allocate_cbk = _new_callback("int(uint8_t **, size_t)", self._allocate)
+
+    def _allocate(self, memory, nbytes: int) -> int:
+        if nbytes > self.size:
+            self.overflow = ffi.new("uint8_t[]", nbytes)
+            memory[0] = self.overflow
+        else:
+            if self.buffer is None:
+                self.buffer = ffi.new("uint8_t[]", self.size)
+                self.allocations += 1
+            memory[0] = self.buffer
+        return lib.ARGON2_OK
+
+    def _free(self, memory, nbytes: int) -> None:
+        self.overflow = None
+
+
+class Argon2BufferPool:
+    """
+    Argon2 hasher that reuses one work area per concurrent slot.
+
+    At most ``slots`` hashes run at once; further callers block until a slot
+    is returned. Buffers are allocated lazily and slots are reused LIFO, so a
+    quiet server only ever touches one buffer.
+    """
+
+    def __init__(
+        self,
+        time_cost: int,
+        memory_cost: int,
+        parallelism: int,
+        hash_len: int,
+        salt_len: int,
+        slots: int,
+        type: Type = Type.ID,
+    ):
+        self.time_cost = time_cost
+        self.memory_cost = memory_cost
+        self.parallelism = parallelism
+        self.hash_len = hash_len
+        self.salt_len = salt_len
+        self.type = type
+        # argon2 rounds memory_cost up to 8 blocks per lane, then down to a
+        # multiple of 4 blocks per lane; this size covers every outcome
+        size = max(memory_cost, 8 * parallelism) * _ARGON2_BLOCK_SIZE
+        self._slots: List[_Slot] = [_Slot(size) for _ in range(slots)]
+        self._available = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self._fallback = PasswordHasher(
+            time_cost=time_cost,
+            memory_cost=memory_cost,
+            parallelism=parallelism,
+            hash_len=hash_len,
+            salt_len=salt_len,
+            type=type,
+        )
+        self._callbacks_unavailable = False
+
+    @classmethod
+    def from_hasher(cls, hasher: PasswordHasher, slots: int) -> "Argon2BufferPool":
+        """Build a pool that produces the same hashes as ``hasher``"""
+        return cls(
+            time_cost=hasher.time_cost,
+            memory_cost=hasher.memory_cost,
+            parallelism=hasher.parallelism,
+            hash_len=hasher.hash_len,
+            salt_len=hasher.salt_len,
+            slots=slots,
+            type=hasher.type,
+        )
+
+    @property
+    def buffer_allocations(self) -> int:
+        """Number of work areas allocated so far"""
+        return sum(slot.allocations for slot in self._slots)
+
+    @contextmanager
+    def _checkout(self) -> Iterator[_Slot]:
+        with self._available:
+            with self._lock:
+                slot = self._slots.pop()
+            try:
+                yield slot
+            finally:
+                with self._lock:
+                    self._slots.append(slot)
+
+    def _use_buffers(self, slot: _Slot) -> bool:
+        """Prepare the slot's callbacks; False when libffi closures are unavailable"""
+        if self._callbacks_unavailable:
+            return False
+        try:
+            slot.ensure_callbacks()
+        except MemoryError:
+            logger.warning(
+                "Cannot create argon2 allocator callbacks; "
+                "hashing without buffer reuse"
+            )
+            self._callbacks_unavailable = True
+            return False
+        return True
+
+    def _raw_hash(
+        self,
+        slot: _Slot,
+        type: Type,
+        version: int,
+        time_cost: int,
+        memory_cost: int,
+        parallelism: int,
+        password: bytes,
+        salt: bytes,
+        hash_len: int,
+    ) -> bytes:
+        out = ffi.new("uint8_t[]", hash_len)
+        pwd = ffi.new("uint8_t[]", password)
+        csalt = ffi.new("uint8_t[]", salt)
+        ctx = ffi.new(
+            "argon2_context *",
+            {
+                "out": out,
+                "outlen": hash_len,
+                "pwd": pwd,
+                "pwdlen": len(password),
+                "salt": csalt,
+                "saltlen": len(salt),
+                "secret": ffi.NULL,
+                "secretlen": 0,
+                "ad": ffi.NULL,
+                "adlen": 0,
+                "t_cost": time_cost,
+                "m_cost": memory_cost,
+                "lanes": parallelism,
+                "threads": parallelism,
+                "version": version,
+                "allocate_cbk": slot.allocate_cbk,
+                "free_cbk": slot.free_cbk,
+                "flags": lib.ARGON2_DEFAULT_FLAGS,
+            },
+        )
+        rc = core(ctx, type.value)
+        if rc != lib.ARGON2_OK:
+            raise HashingError(error_to_str(rc))
+        return bytes(ffi.buffer(out, hash_len))
+
+    def hash(self, password: str) -> str:
+        """Hash ``password`` and return the PHC-encoded string"""
+        with self._checkout() as slot:
+            if not self._use_buffers(slot):
+                return self._fallback.hash(password)
+            salt = os.urandom(self.salt_len)
+            raw = self._raw_hash(
+                slot,
+                self.type,
+                lib.ARGON2_VERSION_NUMBER,
+                self.time_cost,
+                self.memory_cost,
+                self.parallelism,
+                password.encode("utf-8"),
+                salt,
+                self.hash_len,
+            )
+        return (
+            f"$argon2{self.type.name.lower()}$v={lib.ARGON2_VERSION_NUMBER}"
+            f"$m={self.memory_cost},t={self.time_cost},p={self.parallelism}"
+            f"${_b64encode(salt)}${_b64encode(raw)}"
+        )
+
+    def verify(self, hash: str, password: str) -> bool:
+        """
+        Verify ``password`` against a PHC-encoded ``hash``.
+
+        Mirrors ``PasswordHasher.verify``: returns True on success, raises
+        VerifyMismatchError on a wrong password and InvalidHashError when the
+        hash cannot be parsed (including a missing, non-string hash).
+        """
+        if not isinstance(hash, str):
+            raise InvalidHashError
+        params = extract_parameters(hash)
+        salt_b64, hash_b64 = hash.split("$")[-2:]
+        salt = _b64decode(salt_b64)
+        expected = _b64decode(hash_b64)
+        with self._checkout() as slot:
+            if not self._use_buffers(slot):
+                return self._fallback.verify(hash, password)
+            try:
+                raw = self._raw_hash(
+                    slot,
+                    params.type,
+                    params.version,
+                    params.time_cost,
+                    params.memory_cost,
+                    params.parallelism,
+                    password.encode("utf-8"),
+                    salt,
+                    len(expected),
+                )
+            except HashingError as e:
+                raise VerificationError(*e.args) from None
+        if not hmac.compare_digest(raw, expected):
+            raise VerifyMismatchError
+        return True
@@ -1,109 +1,242 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import math
 import os
-from datetime import datetime, timedelta, timezone
-from typing import Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Sequence
 
 import jwt
 from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
-from fastapi import HTTPException, Request
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachetools import TLRUCache, TTLCache
+from dotenv import load_dotenv
+from fastapi import HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+from jwt.types import Options
+from starlette.middleware.cors import CORSMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from api.argon2_pool import Argon2BufferPool
+
+# Load .env before reading configuration at import time
+load_dotenv()
+
+JWT_SECRET = os.environ.get("JWT_SECRET", "your-secret-key-change-in-production")
+JWT_TOKEN_TTL_SECONDS = 7 * 24 * 60 * 60
+API_PASSWORD = os.environ.get("OPEN_NOTEBOOK_PASSWORD")
+
+# Argon2id parameters default to the OWASP Password Storage Cheat Sheet (2024)
+# profile: 46 MiB memory, 1 iteration, 1 lane. Override to re-tune per host.
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", "1"))
+ARGON2_MEMORY_KIB = int(os.environ.get("ARGON2_MEMORY_KIB", "47104"))
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", "1"))
+
+# Signin throttling: attempts per minute per client IP (0 disables), and how
+# long a failed (IP, email, password) attempt is answered without running argon2
+SIGNIN_RATE_LIMIT = int(os.environ.get("SIGNIN_RATE_LIMIT", "20"))
+SIGNIN_FAILURE_COOLDOWN = float(os.environ.get("SIGNIN_FAILURE_COOLDOWN", "5"))
+
+# Each argon2 call needs ARGON2_MEMORY_KIB of work area; hashing runs on at
+# most this many threads, each keeping one buffer once used. Kept small by
+# default: os.cpu_count() reports the host's CPUs, not a container's limit.
+ARGON2_MAX_WORKERS = max(1, int(os.environ.get("ARGON2_MAX_WORKERS", "2")))
+
+# Dedicated threads for argon2, so a login burst cannot occupy the loop's
+# default executor (used for DNS lookups and other blocking calls)
+_argon2_executor = ThreadPoolExecutor(
+    max_workers=ARGON2_MAX_WORKERS, thread_name_prefix="argon2"
+)
 
 # Initialize password hasher
-ph = PasswordHasher()
+ph = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_KIB,
+    parallelism=ARGON2_PARALLELISM,
+    hash_len=32,
+    salt_len=16,
+)
+_argon2_pool = Argon2BufferPool.from_hasher(ph, slots=ARGON2_MAX_WORKERS)
+
+# SurrealDB validates token signatures; the middleware only reads the claims
+_JWT_DECODE_OPTIONS: Options = {
+    "verify_signature": False,
+    "verify_exp": False,
+    "verify_aud": False,
+}
+_jwt_decoder = jwt.PyJWT()
+
+# Decoded JWT payloads are cached for at most this many seconds
+TOKEN_CACHE_TTL = 30
+
+
+def _token_cache_expiry(key, value, now: float) -> float:
+    """Expire a cached token after TOKEN_CACHE_TTL or at its own exp, whichever is first"""
+    exp = value[2]
+    if exp is None:
+        return now + TOKEN_CACHE_TTL
+    return min(now + TOKEN_CACHE_TTL, exp)
+
+
+# Cache of decoded tokens: blake2b(token) -> (user_id, role, exp)
+# Keyed by a digest so raw tokens are never kept in memory
+_token_cache: TLRUCache = TLRUCache(
+    maxsize=10000, ttu=_token_cache_expiry, timer=time.time
+)
+
+
+def _get_authorization_header(scope: Scope) -> Optional[bytes]:
+    """Return the raw Authorization header from an ASGI scope, if present"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            return value
+    return None
+
+
+def _get_bearer_credentials(auth_header: bytes) -> Optional[str]:
+    """Return the credentials of a "Bearer {credentials}" header, or None if malformed"""
+    # The scheme is case-insensitive, so compare the lowered 7-byte prefix
+    if auth_header[:7].lower() != b"bearer ":
+        return None
+    return auth_header[7:].decode("latin-1")
+
 
+def _unauthorized_body(detail: str) -> bytes:
+    """Encode a 401 error detail as a JSON response body"""
+    return json.dumps({"detail": detail}).encode()
 
-class PasswordAuthMiddleware(BaseHTTPMiddleware):
+
+# Bodies for the fixed 401 responses, encoded once at import
+_MISSING_AUTH_BODY = _unauthorized_body("Missing authorization header")
+_INVALID_AUTH_FORMAT_BODY = _unauthorized_body("Invalid authorization header format")
+_INVALID_PASSWORD_BODY = _unauthorized_body("Invalid password")
+
+
+async def _send_unauthorized(send: Send, body: bytes) -> None:
+    """Send a pre-encoded 401 JSON response directly over ASGI"""
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 401,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"www-authenticate", b"Bearer"),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+class PasswordAuthMiddleware:
     """
     Middleware to check password authentication for all API requests.
     Only active when OPEN_NOTEBOOK_PASSWORD environment variable is set.
     """
     
-    def __init__(self, app, excluded_paths: Optional[list] = None):
-        super().__init__(app)
-        self.password = os.environ.get("OPEN_NOTEBOOK_PASSWORD")
-        self.excluded_paths = excluded_paths or ["/", "/health", "/docs", "/openapi.json", "/redoc"]
+    def __init__(self, app: ASGIApp, excluded_paths: Optional[Iterable[str]] = None):
+        self.app = app
+        self.password = API_PASSWORD
+        self._password_bytes = self.password.encode() if self.password else b""
+        self.excluded_paths = frozenset(
+            excluded_paths or ("/", "/health", "/docs", "/openapi.json", "/redoc")
+        )
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Only HTTP requests are authenticated; pass through lifespan/websocket
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
         # Skip authentication if no password is set
         if not self.password:
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
         
         # Skip authentication for excluded paths
-        if request.url.path in self.excluded_paths:
-            return await call_next(request)
+        if scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
         
         # Skip authentication for CORS preflight requests (OPTIONS)
-        if request.method == "OPTIONS":
-            return await call_next(request)
+        if scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
         
         # Check authorization header
-        auth_header = request.headers.get("Authorization")
+        auth_header = _get_authorization_header(scope)
         
         if not auth_header:
-            return JSONResponse(
-                status_code=401,
-                content={"detail": "Missing authorization header"},
-                headers={"WWW-Authenticate": "Bearer"}
-            )
+            await _send_unauthorized(send, _MISSING_AUTH_BODY)
+            return
         
         # Expected format: "Bearer {password}"
-        try:
-            scheme, credentials = auth_header.split(" ", 1)
-            if scheme.lower() != "bearer":
-                raise ValueError("Invalid authentication scheme")
-        except ValueError:
-            return JSONResponse(
-                status_code=401,
-                content={"detail": "Invalid authorization header format"},
-                headers={"WWW-Authenticate": "Bearer"}
-            )
-        
-        # Check password
-        if credentials != self.password:
-            return JSONResponse(
-                status_code=401,
-                content={"detail": "Invalid password"},
-                headers={"WWW-Authenticate": "Bearer"}
-            )
+        credentials = _get_bearer_credentials(auth_header)
+        if credentials is None:
+            await _send_unauthorized(send, _INVALID_AUTH_FORMAT_BODY)
+            return
+        
+        # Check password (constant-time to avoid leaking it through timing)
+        if not hmac.compare_digest(credentials.encode("latin-1"), self._password_bytes):
+            await _send_unauthorized(send, _INVALID_PASSWORD_BODY)
+            return
         
         # Password is correct, proceed with the request
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
 
 
 # Optional: HTTPBearer security scheme for OpenAPI documentation
 security = HTTPBearer(auto_error=False)
 
 
-def hash_password(password: str) -> str:
-    """Hash a password using Argon2"""
-    return ph.hash(password)
+def _hash_password(password: str) -> str:
+    """Hash a password using Argon2 (blocking)"""
+    return _argon2_pool.hash(password)
 
 
-def verify_password(password: str, password_hash: str) -> bool:
-    """Verify a password against its hash"""
+def _verify_password(password: str, password_hash: str) -> bool:
+    """Verify a password against its hash (blocking)"""
     try:
-        ph.verify(password_hash, password)
-        return True
-    except VerifyMismatchError:
+        return _argon2_pool.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
         return False
 
 
+async def hash_password(password: str) -> str:
+    """Hash a password using Argon2 in an argon2 worker thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_argon2_executor, _hash_password, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    """Verify a password against its hash in an argon2 worker thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _argon2_executor, _verify_password, password, password_hash
+    )
+
+
+def shutdown_password_executor() -> None:
+    """Stop the argon2 worker threads, waiting for in-flight hashes"""
+    _argon2_executor.shutdown(wait=True)
+
+
 def create_jwt_token(user_id: str, email: str, role: str) -> str:
     """Create a JWT token for a user"""
-    secret = os.environ.get("JWT_SECRET", "your-secret-key-change-in-production")
+    # Integer epoch seconds are JWT NumericDates, so PyJWT encodes them as-is
+    now = int(time.time())
     
     payload = {
         "ID": user_id,
         "email": email,
         "role": role,
-        "exp": datetime.now(timezone.utc) + timedelta(days=7),
-        "iat": datetime.now(timezone.utc)
+        "exp": now + JWT_TOKEN_TTL_SECONDS,
+        "iat": now
     }
     
-    return jwt.encode(payload, secret, algorithm="HS256")
+    return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
 
 def check_api_password(credentials: Optional[HTTPAuthorizationCredentials] = None) -> bool:
@@ -111,7 +244,7 @@ def check_api_password(credentials: Optional[HTTPAuthorizationCredentials] = Non
     Utility function to check API password.
     Can be used as a dependency in individual routes if needed.
     """
-    password = os.environ.get("OPEN_NOTEBOOK_PASSWORD")
+    password = API_PASSWORD
     
     # No password set, allow access
     if not password:
@@ -125,8 +258,8 @@ def check_api_password(credentials: Optional[HTTPAuthorizationCredentials] = Non
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Check password
-    if credentials.credentials != password:
+    # Check password (constant-time to avoid leaking it through timing)
+    if not hmac.compare_digest(credentials.credentials.encode("latin-1"), password.encode()):
         raise HTTPException(
             status_code=401,
             detail="Invalid password",
@@ -136,75 +269,201 @@ def check_api_password(credentials: Optional[HTTPAuthorizationCredentials] = Non
     return True
 
 
-class JWTAuthMiddleware(BaseHTTPMiddleware):
+class SigninThrottle:
     """
-    Middleware to check JWT authentication for all API requests.
-    Validates JWT tokens from SurrealDB record access.
+    In-memory throttling for signin attempts.
+    Applies a per-IP token bucket and remembers recently failed attempts, so
+    an identical replay is rejected before any argon2 work is done. Failures
+    are keyed on an HMAC of the password, so a corrected password is always
+    verified.
     """
     
-    def __init__(self, app, excluded_paths: Optional[list] = None):
-        super().__init__(app)
-        self.excluded_paths = excluded_paths or [
+    def __init__(self, rate_per_minute: int, failure_cooldown: float):
+        self.capacity = float(rate_per_minute)
+        self.refill_per_second = rate_per_minute / 60
+        # An untouched bucket refills completely within a minute, so expiring
+        # entries after 60s is the same as resetting them to full
+        self._buckets: TTLCache = TTLCache(maxsize=10000, ttl=60)
+        self._recent_failures: TTLCache = TTLCache(
+            maxsize=10000, ttl=max(failure_cooldown, 0.001)
+        )
+        # Per-process key, so the cache never holds a reusable password digest
+        self._failure_key = os.urandom(32)
+    
+    @property
+    def retry_after(self) -> int:
+        """Seconds until a throttled client regains one attempt"""
+        return math.ceil(60 / self.capacity) if self.capacity > 0 else 60
+    
+    def allow(self, ip: str) -> bool:
+        """Consume one attempt from the IP's bucket; False when it is empty"""
+        if self.capacity <= 0:
+            return True
+        now = time.monotonic()
+        tokens, last = self._buckets.get(ip, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - last) * self.refill_per_second)
+        if tokens < 1:
+            self._buckets[ip] = (tokens, now)
+            return False
+        self._buckets[ip] = (tokens - 1, now)
+        return True
+    
+    def _failure_cache_key(self, ip: str, email: str, password: str) -> tuple:
+        digest = hmac.new(self._failure_key, password.encode(), hashlib.sha256).digest()
+        return (ip, email.lower(), digest)
+    
+    def recently_failed(self, ip: str, email: str, password: str) -> bool:
+        """Check whether this exact signin attempt failed within the cooldown"""
+        return self._failure_cache_key(ip, email, password) in self._recent_failures
+    
+    def record_failure(self, ip: str, email: str, password: str) -> None:
+        """Remember a failed signin for this IP, email and password"""
+        self._recent_failures[self._failure_cache_key(ip, email, password)] = True
+    
+    def clear(self) -> None:
+        """Forget all buckets and recorded failures"""
+        self._buckets.clear()
+        self._recent_failures.clear()
+
+
+signin_throttle = SigninThrottle(SIGNIN_RATE_LIMIT, SIGNIN_FAILURE_COOLDOWN)
+
+
+class JWTAuthenticator:
+    """
+    JWT authentication for HTTP request scopes.
+    Used by JWTAuthMiddleware and AuthCorsMiddleware.
+    """
+    
+    def __init__(self, excluded_paths: Optional[Iterable[str]] = None):
+        self.excluded_paths = frozenset(excluded_paths or (
             "/", "/health", "/docs", "/openapi.json", "/redoc",
             "/api/auth/signup", "/api/auth/signin", "/api/auth/status", "/api/config"
-        ]
+        ))
     
-    async def dispatch(self, request: Request, call_next):
+    def authenticate(self, scope: Scope) -> Optional[bytes]:
+        """
+        Authenticate an HTTP request scope.
+        Stores user info in the request state and returns None on success,
+        or returns the 401 response body to send on failure.
+        """
         # Skip authentication for excluded paths
-        if request.url.path in self.excluded_paths:
-            return await call_next(request)
+        if scope["path"] in self.excluded_paths:
+            return None
         
         # Skip authentication for CORS preflight requests (OPTIONS)
-        if request.method == "OPTIONS":
-            return await call_next(request)
+        if scope["method"] == "OPTIONS":
+            return None
         
         # Check authorization header
-        auth_header = request.headers.get("Authorization")
+        auth_header = _get_authorization_header(scope)
         
         if not auth_header:
-            return JSONResponse(
-                status_code=401,
-                content={"detail": "Missing authorization header"},
-                headers={"WWW-Authenticate": "Bearer"}
-            )
+            return _MISSING_AUTH_BODY
         
         # Expected format: "Bearer {jwt_token}"
-        if not auth_header.startswith("Bearer "):
-            return JSONResponse(
-                status_code=401,
-                content={"detail": "Invalid authorization header format"},
-                headers={"WWW-Authenticate": "Bearer"}
-            )
-        
-        token = auth_header.split(" ", 1)[1]
+        token = _get_bearer_credentials(auth_header)
+        if token is None:
+            return _INVALID_AUTH_FORMAT_BODY
         
         try:
-            # Decode JWT token (SurrealDB validates signature)
-            # We just need to extract user info
-            payload = jwt.decode(token, options={"verify_signature": False})
-            user_id = payload.get("ID")
+            cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+            cached = _token_cache.get(cache_key)
             
-            if not user_id:
-                raise ValueError("Invalid token payload - missing user ID")
+            if cached is None:
+                # Decode JWT token (SurrealDB validates signature)
+                # We just need to extract user info
+                payload = _jwt_decoder.decode(token, key="", options=_JWT_DECODE_OPTIONS)
+                user_id = payload.get("ID")
+                
+                if not user_id:
+                    raise ValueError("Invalid token payload - missing user ID")
+                
+                exp = payload.get("exp")
+                if not isinstance(exp, (int, float)):
+                    exp = None
+                cached = (user_id, payload.get("role", "user"), exp)
+                _token_cache[cache_key] = cached
             
-            # Store user info in request state for use in endpoints
-            request.state.user_id = user_id
-            request.state.token = token
-            request.state.user_role = payload.get("role", "user")
-            
-            # Proceed with the request
-            response = await call_next(request)
-            return response
+            user_id, user_role, _ = cached
             
         except jwt.InvalidTokenError as e:
-            return JSONResponse(
-                status_code=401,
-                content={"detail": f"Invalid token: {str(e)}"},
-                headers={"WWW-Authenticate": "Bearer"}
-            )
+            return _unauthorized_body(f"Invalid token: {str(e)}")
         except Exception as e:
-            return JSONResponse(
-                status_code=401,
-                content={"detail": f"Authentication failed: {str(e)}"},
-                headers={"WWW-Authenticate": "Bearer"}
-            )
\ No newline at end of file
+            return _unauthorized_body(f"Authentication failed: {str(e)}")
+        
+        # Store user info in request state for use in endpoints
+        state = scope.setdefault("state", {})
+        state["user_id"] = user_id
+        state["token"] = token
+        state["user_role"] = user_role
+        return None
+
+
+class JWTAuthMiddleware:
+    """
+    Middleware to check JWT authentication for all API requests.
+    Validates JWT tokens from SurrealDB record access.
+    """
+    
+    def __init__(self, app: ASGIApp, excluded_paths: Optional[Iterable[str]] = None):
+        self.app = app
+        self.authenticator = JWTAuthenticator(excluded_paths)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Only HTTP requests are authenticated; pass through lifespan/websocket
+        if scope["type"] == "http":
+            error_body = self.authenticator.authenticate(scope)
+            if error_body is not None:
+                await _send_unauthorized(send, error_body)
+                return
+        
+        # Proceed with the request
+        await self.app(scope, receive, send)
+
+
+class AuthCorsMiddleware:
+    """
+    CORS handling and JWT authentication in a single middleware.
+    A CORSMiddleware wraps the authentication step, so preflight requests are
+    answered before authentication and every other response (including 401s)
+    gets the CORS headers.
+    """
+    
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        excluded_paths: Optional[Iterable[str]] = None,
+        allow_origins: Sequence[str] = (),
+        allow_methods: Sequence[str] = ("GET",),
+        allow_headers: Sequence[str] = (),
+        allow_credentials: bool = False,
+        allow_origin_regex: Optional[str] = None,
+        expose_headers: Sequence[str] = (),
+        max_age: int = 600,
+    ) -> None:
+        self.app = app
+        self.authenticator = JWTAuthenticator(excluded_paths)
+        self.cors = CORSMiddleware(
+            self._authenticated,
+            allow_origins=allow_origins,
+            allow_methods=allow_methods,
+            allow_headers=allow_headers,
+            allow_credentials=allow_credentials,
+            allow_origin_regex=allow_origin_regex,
+            expose_headers=expose_headers,
+            max_age=max_age,
+        )
+    
+    async def _authenticated(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            error_body = self.authenticator.authenticate(scope)
+            if error_body is not None:
+                await _send_unauthorized(send, error_body)
+                return
+        
+        await self.app(scope, receive, send)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.cors(scope, receive, send)
@@ -1,10 +1,14 @@
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 
-from api.auth import JWTAuthMiddleware, PasswordAuthMiddleware
+from api.auth import (
+    AuthCorsMiddleware,
+    PasswordAuthMiddleware,
+    hash_password,
+    shutdown_password_executor,
+)
 from api.routers import (
     auth,
     chat,
@@ -48,15 +52,15 @@ async def lifespan(app: FastAPI):
 
     try:
         migration_manager = AsyncMigrationManager()
-        current_version = await migration_manager.get_current_version()
-        logger.info(f"Current database version: {current_version}")
+        status = await migration_manager.status()
+        logger.info(f"Current database version: {status.current_version}")
 
-        if await migration_manager.needs_migration():
+        if status.needs_migration:
             logger.warning("Database migrations are pending. Running migrations...")
-            await migration_manager.run_migration_up()
-            new_version = await migration_manager.get_current_version()
-            logger.success(f"Migrations completed successfully. Database is now at version {new_version}")
+            app.state.db_version = await migration_manager.run_migration_up(status)
+            logger.success(f"Migrations completed successfully. Database is now at version {app.state.db_version}")
         else:
+            app.state.db_version = status.current_version
             logger.info("Database is already at the latest version. No migrations needed.")
     except Exception as e:
         logger.error(f"CRITICAL: Database migration failed: {str(e)}")
@@ -67,19 +71,20 @@ async def lifespan(app: FastAPI):
     # Ensure admin user exists
     try:
         logger.info("Checking for admin user...")
-        admin_check = await repo_query("SELECT * FROM user:admin")
+        # Only the id is needed to test for existence; skip the password hash
+        admin_check = await repo_query("SELECT id FROM user:admin")
         
-        if not admin_check or len(admin_check) == 0:
+        if not admin_check:
             logger.warning("Admin user not found. Creating default admin user...")
             await repo_query("""
                 CREATE user:admin SET
                   email = "admin@localhost",
-                  password = crypto::argon2::generate("change-me-immediately"),
+                  password = $password_hash,
                   name = "System Administrator",
                   role = "admin",
                   created = time::now(),
                   updated = time::now()
-            """)
+            """, {"password_hash": await hash_password("change-me-immediately")})
             logger.success("Admin user created successfully. Email: admin@localhost, Password: change-me-immediately")
             logger.warning("⚠️  IMPORTANT: Change the admin password immediately after first login!")
         else:
@@ -93,7 +98,8 @@ async def lifespan(app: FastAPI):
     # Yield control to the application
     yield
 
-    # Shutdown: cleanup if needed
+    # Shutdown: stop the argon2 worker threads
+    shutdown_password_executor()
     logger.info("API shutdown complete")
 
 
@@ -104,37 +110,14 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-# Add JWT authentication middleware
-# Exclude public endpoints from authentication
-app.add_middleware(
-    JWTAuthMiddleware,
-    excluded_paths=[
-        "/", "/health", "/docs", "/openapi.json", "/redoc",
-        "/api/auth/signup", "/api/auth/signin", "/api/auth/status", "/api/config"
-    ]
-)
-# Add JWT authentication middleware
-# Exclude public endpoints from authentication
-app.add_middleware(
-    JWTAuthMiddleware,
-    excluded_paths=[
-        "/", "/health", "/docs", "/openapi.json", "/redoc",
-        "/api/auth/signup", "/api/auth/signin", "/api/auth/status", "/api/config"
-    ]
-)
-# Add JWT authentication middleware
-# Exclude public endpoints from authentication
+# Add CORS and JWT authentication as a single middleware
+# CORS preflights are answered before auth; public endpoints skip auth
 app.add_middleware(
-    JWTAuthMiddleware,
+    AuthCorsMiddleware,
     excluded_paths=[
         "/", "/health", "/docs", "/openapi.json", "/redoc",
         "/api/auth/signup", "/api/auth/signin", "/api/auth/status", "/api/config"
-    ]
-)
-
-# Add CORS middleware last (so it processes first)
-app.add_middleware(
-    CORSMiddleware,
+    ],
     allow_origins=["*"],  # In production, replace with specific origins
     allow_credentials=True,
     allow_methods=["*"],
@@ -3,14 +3,15 @@ Authentication router for Open Notebook API.
 Provides endpoints for user authentication (signup, signin, status).
 """
 
-import os
+import asyncio
+import random
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, status
 from loguru import logger
 from pydantic import BaseModel, EmailStr
 
-from api.auth import create_jwt_token, hash_password, verify_password
+from api.auth import create_jwt_token, hash_password, signin_throttle, verify_password
 from open_notebook.database.repository import repo_create, repo_query
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -55,28 +56,30 @@ async def signup(request: SignupRequest):
     """
     Register a new user account.
     
-    Creates a new user with email, password (hashed with Argon2), and name.
+    Creates a new user with email, password (hashed locally with Argon2), and name.
     Returns a JWT token for immediate authentication.
     """
     try:
         # Check if user already exists
         existing_users = await repo_query(
-            "SELECT id FROM user WHERE email = $email",
+            "SELECT id FROM user WHERE email = $email LIMIT 1",
             {"email": request.email}
         )
         
-        if existing_users and len(existing_users) > 0:
+        if existing_users:
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="An account with this email already exists"
             )
         
+        # Hash the password locally (argon2 runs in a worker thread)
+        password_hash = await hash_password(request.password)
+        
         # Create user directly with SurrealQL
-        # Use crypto::argon2::generate for password hashing (SurrealDB built-in)
         created_users = await repo_query("""
             CREATE user CONTENT {
                 email: $email,
-                password: crypto::argon2::generate($password),
+                password: $password_hash,
                 name: $name,
                 role: $role,
                 created: time::now(),
@@ -84,7 +87,7 @@ async def signup(request: SignupRequest):
             }
         """, {
             "email": request.email,
-            "password": request.password,
+            "password_hash": password_hash,
             "name": request.name,
             "role": "user"
         })
@@ -130,73 +133,63 @@ async def signup(request: SignupRequest):
 
 
 @router.post("/signin", response_model=TokenResponse)
-async def signin(request: SigninRequest):
+async def signin(request: SigninRequest, http_request: Request):
     """
     Authenticate an existing user.
     
     Validates email and password, returns JWT token on success.
+    Attempts are rate limited per client IP, and an exact replay of a
+    recently failed attempt is rejected without re-running password
+    verification.
     """
+    # Behind a proxy, uvicorn's proxy headers (FORWARDED_ALLOW_IPS) already
+    # resolve this to the original client address
+    client_ip = http_request.client.host if http_request.client else "unknown"
+    
     try:
-        from surrealdb import AsyncSurreal
-        from open_notebook.database.repository import get_database_url, get_database_password
-        
-        # Connect with root credentials to bypass permissions
-        db = AsyncSurreal(get_database_url())
-        await db.signin({
-            "username": os.environ.get("SURREAL_USER"),
-            "password": get_database_password(),
-        })
-        await db.use(
-            os.environ.get("SURREAL_NAMESPACE"),
-            os.environ.get("SURREAL_DATABASE")
-        )
-        
-        # Query all users and filter in Python
-        # This is a workaround for the permissions issue
-        all_users = await db.query("SELECT * FROM user")
-        
-        # Find the user with matching email
-        user = None
-        for u in all_users:
-            if u.get("email") == request.email:
-                user = u
-                break
+        if not signin_throttle.allow(client_ip):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many signin attempts. Please try again later.",
+                headers={"Retry-After": str(signin_throttle.retry_after)}
+            )
         
-        if not user:
-            await db.close()
+        if signin_throttle.recently_failed(client_ip, request.email, request.password):
+            # Same password already failed: answer like a normal failure, after a
+            # jittered delay, without argon2
+            await asyncio.sleep(random.uniform(0.1, 0.3))
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
         
-        # Verify password
-        password_check = await db.query("""
-            RETURN crypto::argon2::compare($hash, $password);
-        """, {
-            "hash": user.get("password"),
-            "password": request.password
-        })
+        # Look up the user by email (uses the email_unique index)
+        # repo_query runs with root credentials, bypassing user table permissions
+        users = await repo_query(
+            "SELECT * FROM user WHERE email = $email LIMIT 1",
+            {"email": request.email}
+        )
+        user = users[0] if users else None
         
-        # password_check is a boolean value
-        if not password_check or not password_check:
-            await db.close()
+        if not user:
+            signin_throttle.record_failure(client_ip, request.email, request.password)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
         
-        result = [user]
-        
-        await db.close()
+        # Verify password locally (argon2 runs in a worker thread)
+        password_valid = await verify_password(
+            request.password, user.get("password", "")
+        )
         
-        # result is a list of query results
-        if not result or len(result) == 0 or result[0] is None:
+        if not password_valid:
+            signin_throttle.record_failure(client_ip, request.email, request.password)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
         
-        user = result[0]
         user_id = str(user.get("id", ""))
         user_email = user.get("email", request.email)
         user_name = user.get("name", "")
@@ -3,7 +3,8 @@ Async migration system for SurrealDB using the official Python client.
 Based on patterns from sblpy migration system.
 """
 
-from typing import List
+from dataclasses import dataclass
+from typing import List, Optional
 
 from loguru import logger
 
@@ -63,9 +64,10 @@ class AsyncMigrationRunner:
         self.up_migrations = up_migrations
         self.down_migrations = down_migrations
 
-    async def run_all(self) -> None:
-        """Run all pending up migrations."""
-        current_version = await get_latest_version()
+    async def run_all(self, current_version: Optional[int] = None) -> None:
+        """Run all pending up migrations, starting after current_version if given."""
+        if current_version is None:
+            current_version = await get_latest_version()
 
         for i in range(current_version, len(self.up_migrations)):
             logger.info(f"Running migration {i + 1}")
@@ -88,6 +90,19 @@ class AsyncMigrationRunner:
             await self.down_migrations[current_version - 1].run(bump=False)
 
 
+@dataclass
+class MigrationStatus:
+    """Database version compared to the bundled migrations."""
+
+    current_version: int
+    target_version: int
+
+    @property
+    def needs_migration(self) -> bool:
+        """Whether there are migrations left to apply."""
+        return self.current_version < self.target_version
+
+
 class AsyncMigrationManager:
     """
     Main migration manager with async support.
@@ -128,26 +143,38 @@ class AsyncMigrationManager:
         """Get current database version."""
         return await get_latest_version()
 
+    async def status(self) -> MigrationStatus:
+        """Get current and target versions with a single version query."""
+        return MigrationStatus(
+            current_version=await self.get_current_version(),
+            target_version=len(self.up_migrations),
+        )
+
     async def needs_migration(self) -> bool:
         """Check if migration is needed."""
-        current_version = await self.get_current_version()
-        return current_version < len(self.up_migrations)
-
-    async def run_migration_up(self):
-        """Run all pending migrations."""
-        current_version = await self.get_current_version()
-        logger.info(f"Current version before migration: {current_version}")
-
-        if await self.needs_migration():
-            try:
-                await self.runner.run_all()
-                new_version = await self.get_current_version()
-                logger.info(f"Migration successful. New version: {new_version}")
-            except Exception as e:
-                logger.error(f"Migration failed: {str(e)}")
-                raise
-        else:
+        return (await self.status()).needs_migration
+
+    async def run_migration_up(self, status: Optional[MigrationStatus] = None) -> int:
+        """
+        Run all pending migrations and return the resulting version.
+        Pass a status already read with status() to skip querying it again.
+        """
+        if status is None:
+            status = await self.status()
+        logger.info(f"Current version before migration: {status.current_version}")
+
+        if not status.needs_migration:
             logger.info("Database is already at the latest version")
+            return status.current_version
+
+        try:
+            await self.runner.run_all(status.current_version)
+            new_version = await self.get_current_version()
+            logger.info(f"Migration successful. New version: {new_version}")
+            return new_version
+        except Exception as e:
+            logger.error(f"Migration failed: {str(e)}")
+            raise
 
 
 # Database version management functions
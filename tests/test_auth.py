@@ -0,0 +1,581 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, patch
+
+import jwt
+import pytest
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.testclient import TestClient
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+from api import argon2_pool, auth
+from api.argon2_pool import Argon2BufferPool
+from api.auth import (
+    AuthCorsMiddleware,
+    JWTAuthenticator,
+    JWTAuthMiddleware,
+    PasswordAuthMiddleware,
+    create_jwt_token,
+    hash_password,
+    verify_password,
+)
+
+
+@pytest.fixture
+def client():
+    """Create a minimal app protected by JWTAuthMiddleware."""
+    app = FastAPI()
+    app.add_middleware(JWTAuthMiddleware, excluded_paths=["/health"])
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    @app.get("/me")
+    async def me(request: Request):
+        return {"id": request.state.user_id, "role": request.state.user_role}
+
+    auth._token_cache.clear()
+    return TestClient(app)
+
+
+@pytest.fixture
+def password_client(monkeypatch):
+    """Create a minimal app protected by PasswordAuthMiddleware."""
+    monkeypatch.setattr(auth, "API_PASSWORD", "secret")
+    app = FastAPI()
+    app.add_middleware(PasswordAuthMiddleware)
+
+    @app.get("/data")
+    async def data():
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+class TestPasswordAuthMiddleware:
+    """Test suite for password authentication middleware."""
+
+    def test_check_api_password_uses_same_password(self, password_client):
+        """Test that check_api_password and the middleware share one password."""
+        good = HTTPAuthorizationCredentials(scheme="Bearer", credentials="secret")
+        bad = HTTPAuthorizationCredentials(scheme="Bearer", credentials="wrong")
+
+        assert auth.check_api_password(good) is True
+        with pytest.raises(HTTPException):
+            auth.check_api_password(bad)
+
+    def test_correct_password(self, password_client):
+        """Test that the configured password grants access."""
+        response = password_client.get(
+            "/data", headers={"Authorization": "Bearer secret"}
+        )
+
+        assert response.status_code == 200
+
+    def test_wrong_password(self, password_client):
+        """Test that a wrong password is rejected with a JSON 401."""
+        response = password_client.get(
+            "/data", headers={"Authorization": "Bearer wrong"}
+        )
+
+        assert response.status_code == 401
+        assert response.headers["www-authenticate"] == "Bearer"
+        assert response.json()["detail"] == "Invalid password"
+
+    def test_preflight_skips_auth(self, password_client):
+        """Test that OPTIONS requests are not authenticated."""
+        response = password_client.options("/data")
+
+        assert response.status_code != 401
+
+
+class TestJWTAuthMiddleware:
+    """Test suite for JWT authentication middleware."""
+
+    def test_excluded_path_skips_auth(self, client):
+        """Test that excluded paths do not require a token."""
+        response = client.get("/health")
+
+        assert response.status_code == 200
+
+    def test_missing_authorization_header(self, client):
+        """Test that requests without a token are rejected."""
+        response = client.get("/me")
+
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Missing authorization header"
+
+    def test_invalid_authorization_format(self, client):
+        """Test that non-bearer schemes are rejected."""
+        response = client.get("/me", headers={"Authorization": "Basic abc"})
+
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Invalid authorization header format"
+
+    def test_invalid_token(self, client):
+        """Test that malformed tokens are rejected."""
+        response = client.get("/me", headers={"Authorization": "Bearer not-a-jwt"})
+
+        assert response.status_code == 401
+        assert response.json()["detail"].startswith("Invalid token")
+
+    def test_bearer_scheme_is_case_insensitive(self, client):
+        """Test that the bearer scheme is matched regardless of case."""
+        token = create_jwt_token("user:123", "user@example.com", "user")
+
+        response = client.get("/me", headers={"Authorization": f"bearer {token}"})
+
+        assert response.status_code == 200
+
+    def test_valid_token_sets_request_state(self, client):
+        """Test that a valid token exposes user info to the endpoint."""
+        token = create_jwt_token("user:123", "user@example.com", "admin")
+
+        response = client.get("/me", headers={"Authorization": f"Bearer {token}"})
+
+        assert response.status_code == 200
+        assert response.json() == {"id": "user:123", "role": "admin"}
+
+    def test_token_decoded_once_per_cache_window(self, client):
+        """Test that repeated requests with the same token hit the cache."""
+        token = create_jwt_token("user:123", "user@example.com", "user")
+
+        with patch.object(
+            auth._jwt_decoder, "decode", wraps=auth._jwt_decoder.decode
+        ) as mock_decode:
+            for _ in range(3):
+                response = client.get(
+                    "/me", headers={"Authorization": f"Bearer {token}"}
+                )
+                assert response.status_code == 200
+
+        assert mock_decode.call_count == 1
+
+
+class TestJWTAuthenticator:
+    """Test suite for the authenticator shared by both JWT middlewares."""
+
+    def test_valid_token_sets_state(self):
+        """Test that a valid token authenticates and fills the scope state."""
+        token = create_jwt_token("user:123", "user@example.com", "admin")
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/me",
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+        }
+
+        assert JWTAuthenticator().authenticate(scope) is None
+        assert scope["state"]["user_id"] == "user:123"
+        assert scope["state"]["user_role"] == "admin"
+
+    def test_missing_header_returns_error_body(self):
+        """Test that a missing header yields the 401 body without raising."""
+        scope = {"type": "http", "method": "GET", "path": "/me", "headers": []}
+
+        assert JWTAuthenticator().authenticate(scope) == auth._MISSING_AUTH_BODY
+        assert "state" not in scope
+
+
+@pytest.fixture
+def cors_client():
+    """Create a minimal app protected by AuthCorsMiddleware."""
+    app = FastAPI()
+    app.add_middleware(
+        AuthCorsMiddleware,
+        excluded_paths=["/health"],
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    @app.get("/me")
+    async def me(request: Request):
+        return {"id": request.state.user_id}
+
+    auth._token_cache.clear()
+    return TestClient(app)
+
+
+class TestAuthCorsMiddleware:
+    """Test suite for the combined CORS and JWT middleware."""
+
+    def test_preflight_answered_without_auth(self, cors_client):
+        """Test that CORS preflights succeed without a token."""
+        response = cors_client.options(
+            "/me",
+            headers={
+                "Origin": "http://localhost:3000",
+                "Access-Control-Request-Method": "GET",
+                "Access-Control-Request-Headers": "authorization",
+            },
+        )
+
+        assert response.status_code == 200
+        assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
+        assert response.headers["access-control-allow-headers"] == "authorization"
+
+    def test_unauthorized_response_has_cors_headers(self, cors_client):
+        """Test that 401s are still readable by the browser."""
+        response = cors_client.get("/me", headers={"Origin": "http://localhost:3000"})
+
+        assert response.status_code == 401
+        assert response.headers["access-control-allow-origin"] == "*"
+        assert response.json()["detail"] == "Missing authorization header"
+
+    def test_authenticated_request_has_cors_headers(self, cors_client):
+        """Test that authenticated requests reach the endpoint with CORS headers."""
+        token = create_jwt_token("user:123", "user@example.com", "user")
+
+        response = cors_client.get(
+            "/me",
+            headers={"Origin": "http://localhost:3000", "Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status_code == 200
+        assert response.headers["access-control-allow-origin"] == "*"
+        assert response.json() == {"id": "user:123"}
+
+    def test_request_without_origin(self, cors_client):
+        """Test that same-origin requests are authenticated without CORS headers."""
+        response = cors_client.get("/me")
+
+        assert response.status_code == 401
+        assert "access-control-allow-origin" not in response.headers
+
+
+class TestCreateJWTToken:
+    """Test suite for JWT token creation."""
+
+    def test_token_claims(self):
+        """Test that tokens carry user claims and a 7-day integer expiry."""
+        token = create_jwt_token("user:123", "user@example.com", "admin")
+
+        payload = jwt.decode(token, auth.JWT_SECRET, algorithms=["HS256"])
+
+        assert payload["ID"] == "user:123"
+        assert payload["email"] == "user@example.com"
+        assert payload["role"] == "admin"
+        assert isinstance(payload["iat"], int)
+        assert payload["exp"] - payload["iat"] == 7 * 24 * 60 * 60
+
+
+class TestAppMiddleware:
+    """Test suite for the API middleware stack."""
+
+    def test_auth_cors_middleware_registered_once(self):
+        """Test that auth runs through a single AuthCorsMiddleware registration."""
+        from api.main import app
+
+        registrations = [m.cls for m in app.user_middleware]
+
+        assert registrations.count(AuthCorsMiddleware) == 1
+        assert JWTAuthMiddleware not in registrations
+
+
+class TestPasswordHashing:
+    """Test suite for Argon2 password helpers."""
+
+    @pytest.mark.asyncio
+    async def test_hash_and_verify_roundtrip(self):
+        """Test that a hashed password verifies and a wrong one does not."""
+        password_hash = await hash_password("correct-password")
+
+        assert await verify_password("correct-password", password_hash)
+        assert not await verify_password("wrong-password", password_hash)
+
+    @pytest.mark.asyncio
+    async def test_hashing_uses_dedicated_executor(self, monkeypatch):
+        """Test that argon2 runs on its own threads, not the default executor."""
+        monkeypatch.setattr(auth, "_hash_password", lambda password: threading.current_thread().name)
+
+        thread_name = await hash_password("password")
+
+        assert thread_name.startswith("argon2")
+
+    @pytest.mark.asyncio
+    async def test_verify_rejects_malformed_hash(self):
+        """Test that an unparseable stored hash fails verification."""
+        assert not await verify_password("password", "not-a-hash")
+
+    @pytest.mark.asyncio
+    async def test_verify_rejects_missing_hash(self):
+        """Test that a user without a stored hash (NONE/null) fails verification."""
+        assert not await verify_password("password", None)
+
+
+def small_pool(slots=2):
+    """Create a cheap buffer pool for tests."""
+    return Argon2BufferPool(
+        time_cost=1, memory_cost=64, parallelism=1, hash_len=32, salt_len=16, slots=slots
+    )
+
+
+class TestArgon2BufferPool:
+    """Test suite for the preallocated argon2 buffer pool."""
+
+    def test_hashes_interoperate_with_password_hasher(self):
+        """Test that pool hashes and PasswordHasher hashes verify both ways."""
+        pool = small_pool()
+        hasher = PasswordHasher(time_cost=1, memory_cost=64, parallelism=1)
+
+        assert hasher.verify(pool.hash("password"), "password")
+        assert pool.verify(hasher.hash("password"), "password")
+
+    def test_verify_errors_match_password_hasher(self):
+        """Test that mismatches and malformed hashes raise argon2's errors."""
+        pool = small_pool()
+        password_hash = pool.hash("password")
+
+        with pytest.raises(VerifyMismatchError):
+            pool.verify(password_hash, "wrong")
+        with pytest.raises(InvalidHashError):
+            pool.verify("not-a-hash", "password")
+        with pytest.raises(InvalidHashError):
+            pool.verify(None, "password")
+        with pytest.raises(InvalidHashError):
+            pool.verify(password_hash.rsplit("$", 1)[0] + "$!!!", "password")
+
+    def test_reuses_buffers(self):
+        """Test that sequential hashes reuse a single work area."""
+        pool = small_pool()
+
+        for _ in range(5):
+            pool.verify(pool.hash("password"), "password")
+
+        assert pool.buffer_allocations == 1
+
+    def test_falls_back_without_ffi_callbacks(self, monkeypatch):
+        """Test that hosts denying W+X memory still hash via PasswordHasher."""
+        def deny_execmem(signature, fn):
+            raise MemoryError("Cannot allocate write+execute memory")
+
+        monkeypatch.setattr(argon2_pool, "_new_callback", deny_execmem)
+        pool = small_pool()
+        hasher = PasswordHasher(time_cost=1, memory_cost=64, parallelism=1)
+
+        password_hash = pool.hash("password")
+
+        assert hasher.verify(password_hash, "password")
+        assert pool.verify(hasher.hash("password"), "password")
+        with pytest.raises(VerifyMismatchError):
+            pool.verify(password_hash, "wrong")
+        assert pool.buffer_allocations == 0
+
+    def test_verifies_hash_with_larger_memory_cost(self):
+        """Test that stored hashes above the pool's memory_cost still verify."""
+        pool = small_pool()
+        hasher = PasswordHasher(time_cost=1, memory_cost=256, parallelism=1)
+
+        assert pool.verify(hasher.hash("password"), "password")
+
+    def test_slots_bound_concurrency(self, monkeypatch):
+        """Test that no more than `slots` hashes run at the same time."""
+        pool = small_pool(slots=2)
+        lock = threading.Lock()
+        active = 0
+        peak = 0
+
+        def slow_core(ctx, type):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.05)
+            with lock:
+                active -= 1
+            return real_core(ctx, type)
+
+        real_core = argon2_pool.core
+        monkeypatch.setattr(argon2_pool, "core", slow_core)
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            hashes = list(executor.map(pool.hash, ["password"] * 6))
+
+        assert peak == 2
+        assert pool.buffer_allocations == 2
+        assert all(pool.verify(h, "password") for h in hashes)
+
+
+@pytest.fixture
+def api_client():
+    """Create test client for the full API app."""
+    from api.main import app
+    auth.signin_throttle.clear()
+    return TestClient(app)
+
+
+class TestSignup:
+    """Test suite for the signup endpoint."""
+
+    @patch("api.routers.auth.repo_query", new_callable=AsyncMock)
+    def test_signup_stores_argon2_hash(self, mock_repo_query, api_client):
+        """Test that signup hashes the password before storing it."""
+        mock_repo_query.side_effect = [[], [{"id": "user:new"}]]
+
+        response = api_client.post(
+            "/api/auth/signup",
+            json={"email": "new@example.com", "password": "new-password", "name": "New"}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["user_id"] == "user:new"
+        stored_hash = mock_repo_query.call_args_list[1].args[1]["password_hash"]
+        assert stored_hash.startswith("$argon2id$")
+        assert auth.ph.verify(stored_hash, "new-password")
+
+
+class TestSignin:
+    """Test suite for the signin endpoint."""
+
+    @patch("api.routers.auth.repo_query", new_callable=AsyncMock)
+    def test_signin_success(self, mock_repo_query, api_client):
+        """Test that a correct password returns a token for the user."""
+        mock_repo_query.return_value = [{
+            "id": "user:123",
+            "email": "user@example.com",
+            "name": "User",
+            "role": "user",
+            "password": auth.ph.hash("correct-password"),
+        }]
+
+        response = api_client.post(
+            "/api/auth/signin",
+            json={"email": "user@example.com", "password": "correct-password"}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["user_id"] == "user:123"
+        payload = jwt.decode(response.json()["token"], options={"verify_signature": False})
+        assert payload["ID"] == "user:123"
+
+    @patch("api.routers.auth.repo_query", new_callable=AsyncMock)
+    def test_signin_wrong_password(self, mock_repo_query, api_client):
+        """Test that a wrong password is rejected."""
+        mock_repo_query.return_value = [{
+            "id": "user:123",
+            "email": "user@example.com",
+            "password": auth.ph.hash("correct-password"),
+        }]
+
+        response = api_client.post(
+            "/api/auth/signin",
+            json={"email": "user@example.com", "password": "wrong-password"}
+        )
+
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Invalid email or password"
+
+    @patch("api.routers.auth.repo_query", new_callable=AsyncMock)
+    def test_signin_unknown_email(self, mock_repo_query, api_client):
+        """Test that an unknown email is rejected."""
+        mock_repo_query.return_value = []
+
+        response = api_client.post(
+            "/api/auth/signin",
+            json={"email": "nobody@example.com", "password": "whatever"}
+        )
+
+        assert response.status_code == 401
+
+
+class TestSigninThrottle:
+    """Test suite for signin rate limiting and failure short-circuiting."""
+
+    @patch("api.routers.auth.repo_query", new_callable=AsyncMock)
+    def test_rate_limit_per_ip(self, mock_repo_query, api_client):
+        """Test that attempts beyond the per-minute limit get a 429."""
+        mock_repo_query.return_value = []
+
+        for i in range(auth.SIGNIN_RATE_LIMIT):
+            response = api_client.post(
+                "/api/auth/signin",
+                json={"email": f"user{i}@example.com", "password": "whatever"}
+            )
+            assert response.status_code == 401
+
+        response = api_client.post(
+            "/api/auth/signin",
+            json={"email": "another@example.com", "password": "whatever"}
+        )
+
+        assert response.status_code == 429
+        assert "retry-after" in response.headers
+
+    @patch("api.routers.auth.verify_password", new_callable=AsyncMock)
+    @patch("api.routers.auth.repo_query", new_callable=AsyncMock)
+    def test_recent_failure_skips_verification(self, mock_repo_query, mock_verify, api_client):
+        """Test that a repeated failed signin is rejected without argon2."""
+        mock_repo_query.return_value = [{"id": "user:123", "password": "hash"}]
+        mock_verify.return_value = False
+
+        for _ in range(2):
+            response = api_client.post(
+                "/api/auth/signin",
+                json={"email": "user@example.com", "password": "wrong-password"}
+            )
+            assert response.status_code == 401
+
+        assert mock_verify.await_count == 1
+
+    @patch("api.routers.auth.repo_query", new_callable=AsyncMock)
+    def test_correct_password_after_typo_succeeds(self, mock_repo_query, api_client):
+        """Test that a corrected password is verified despite a recent failure."""
+        password_hash = auth.ph.hash("correct-password")
+        mock_repo_query.return_value = [{
+            "id": "user:123",
+            "email": "user@example.com",
+            "name": "User",
+            "role": "user",
+            "password": password_hash,
+        }]
+
+        response = api_client.post(
+            "/api/auth/signin",
+            json={"email": "user@example.com", "password": "correct-passwrod"}
+        )
+        assert response.status_code == 401
+
+        response = api_client.post(
+            "/api/auth/signin",
+            json={"email": "user@example.com", "password": "correct-password"}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["user_id"] == "user:123"
+
+    @patch("api.routers.auth.repo_query", new_callable=AsyncMock)
+    def test_clients_behind_trusted_proxy_have_separate_limits(self, mock_repo_query):
+        """Test that users behind uvicorn's trusted proxy are throttled independently."""
+        from api.main import app
+        auth.signin_throttle.clear()
+        # uvicorn wraps the app like this for FORWARDED_ALLOW_IPS peers
+        proxied_client = TestClient(
+            ProxyHeadersMiddleware(app, trusted_hosts="127.0.0.1"),
+            client=("127.0.0.1", 50000),
+        )
+        mock_repo_query.return_value = []
+
+        def signin(forwarded_for, email):
+            return proxied_client.post(
+                "/api/auth/signin",
+                json={"email": email, "password": "whatever"},
+                headers={"X-Forwarded-For": forwarded_for},
+            )
+
+        for i in range(auth.SIGNIN_RATE_LIMIT):
+            assert signin("203.0.113.1", f"user{i}@example.com").status_code == 401
+        assert signin("203.0.113.1", "another@example.com").status_code == 429
+
+        # Another user behind the same proxy is neither throttled nor
+        # caught by the first user's failed attempt
+        with patch("api.routers.auth.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+            assert signin("203.0.113.2", "user0@example.com").status_code == 401
+        mock_sleep.assert_not_awaited()
+        assert mock_repo_query.await_count == auth.SIGNIN_RATE_LIMIT + 1
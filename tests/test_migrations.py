@@ -0,0 +1,112 @@
+"""
+Unit tests for the open_notebook.database.async_migrate module.
+
+Version lookups are mocked, so no database is needed.
+"""
+
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from open_notebook.database.async_migrate import AsyncMigrationManager, MigrationStatus
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    """Create a migration manager from the bundled migration files."""
+    monkeypatch.chdir(Path(__file__).parent.parent)
+    return AsyncMigrationManager()
+
+
+class TestMigrationStatus:
+    """Test suite for MigrationStatus."""
+
+    def test_up_to_date_at_target(self):
+        """Test that no migration is needed once current reaches target."""
+        assert not MigrationStatus(current_version=10, target_version=10).needs_migration
+
+    def test_needs_migration_below_target(self):
+        """Test that a version below target needs migration."""
+        assert MigrationStatus(current_version=9, target_version=10).needs_migration
+
+
+class TestAsyncMigrationManager:
+    """Test suite for AsyncMigrationManager version handling."""
+
+    @pytest.mark.asyncio
+    @patch("open_notebook.database.async_migrate.get_latest_version", new_callable=AsyncMock)
+    async def test_status_queries_version_once(self, mock_version, manager):
+        """Test that status() issues a single version query."""
+        mock_version.return_value = 4
+
+        status = await manager.status()
+
+        assert mock_version.await_count == 1
+        assert status == MigrationStatus(current_version=4, target_version=10)
+        assert status.target_version == len(manager.up_migrations)
+
+    @pytest.mark.asyncio
+    @patch("open_notebook.database.async_migrate.get_latest_version", new_callable=AsyncMock)
+    async def test_needs_migration_boundary(self, mock_version, manager):
+        """Test needs_migration just below and at the latest version."""
+        target = len(manager.up_migrations)
+
+        mock_version.return_value = target - 1
+        assert await manager.needs_migration()
+
+        mock_version.return_value = target
+        assert not await manager.needs_migration()
+
+    @pytest.mark.asyncio
+    @patch("open_notebook.database.async_migrate.get_latest_version", new_callable=AsyncMock)
+    async def test_run_migration_up_when_current(self, mock_version, manager):
+        """Test that an up-to-date database returns its version without migrating."""
+        mock_version.return_value = len(manager.up_migrations)
+
+        with patch.object(manager.runner, "run_all", new_callable=AsyncMock) as mock_run_all:
+            version = await manager.run_migration_up()
+
+        assert version == len(manager.up_migrations)
+        mock_run_all.assert_not_awaited()
+        assert mock_version.await_count == 1
+
+    @pytest.mark.asyncio
+    @patch("open_notebook.database.async_migrate.get_latest_version", new_callable=AsyncMock)
+    async def test_run_migration_up_returns_new_version(self, mock_version, manager):
+        """Test that migrating returns the version read after run_all."""
+        mock_version.side_effect = [7, 10]
+
+        with patch.object(manager.runner, "run_all", new_callable=AsyncMock) as mock_run_all:
+            version = await manager.run_migration_up()
+
+        assert version == 10
+        mock_run_all.assert_awaited_once_with(7)
+        assert mock_version.await_count == 2
+
+    @pytest.mark.asyncio
+    @patch("open_notebook.database.async_migrate.get_latest_version", new_callable=AsyncMock)
+    async def test_run_migration_up_reuses_given_status(self, mock_version, manager):
+        """Test that a status read by the caller is not queried again."""
+        mock_version.return_value = 10
+        status = MigrationStatus(current_version=7, target_version=10)
+
+        with patch.object(manager.runner, "run_all", new_callable=AsyncMock) as mock_run_all:
+            version = await manager.run_migration_up(status)
+
+        assert version == 10
+        mock_run_all.assert_awaited_once_with(7)
+        # Only the version read after migrating
+        assert mock_version.await_count == 1
+
+    @pytest.mark.asyncio
+    @patch("open_notebook.database.async_migrate.get_latest_version", new_callable=AsyncMock)
+    async def test_run_all_starts_after_given_version(self, mock_version, manager):
+        """Test that run_all skips the version query when it is passed in."""
+        migrations = [AsyncMock() for _ in manager.up_migrations]
+        manager.runner.up_migrations = migrations
+
+        await manager.runner.run_all(8)
+
+        mock_version.assert_not_awaited()
+        assert [m.run.await_count for m in migrations] == [0] * 8 + [1, 1]